@@ -0,0 +1,17 @@
+# color_scale.py
+#
+# Color-scale helpers shared by the PNG scripts (evap/precip, WorldClim LGM); scripts are run
+# from this folder so it resolves as a sibling module.
+
+import numpy as np
+
+
+def partition_percentile(values: np.ndarray, pct: float) -> float:
+    """
+    Percentile of a 1D array of finite values using np.partition (linear-time selection)
+    instead of a full sort. Takes the nearest lower order statistic rather than
+    interpolating, which is plenty for a color-scale cap. Partitions `values` in place.
+    """
+    k = int(pct / 100.0 * (values.size - 1))
+    values.partition(k)
+    return float(values[k])
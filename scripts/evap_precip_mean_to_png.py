@@ -3,9 +3,9 @@
 # Step 2/2: read the mean NetCDF and render a PNG:
 #   Red  = evaporation amount (upward, so we use evap_pos = max(-e_mean, 0))
 #   Blue = precipitation amount (tp_mean clipped >= 0)
-# Both share a robust vmax (99th percentile over both), with optional gamma boost for low values.
+# Both share a robust vmax (the larger of the two fields' 99th percentiles), with optional gamma boost for low values.
 #
-# Assumes mean file latitude is ascending (south->north). If so, we flipud for north-up PNG.
+# Assumes mean file latitude is ascending (south->north). If so, rows are written bottom-up for a north-up PNG.
 
 import io
 import os
@@ -14,6 +14,10 @@ import xarray as xr
 from PIL import Image
 from dotenv import load_dotenv
 from pathlib import Path
+from color_scale import partition_percentile
+
+# PNG is lossless at every level; 1 encodes much faster than Pillow's default 6 for ~10% larger files.
+PNG_COMPRESS_LEVEL = 1
 
 
 def resolve_paths():
@@ -40,47 +44,94 @@ def scale_0_to_vmax(a: np.ndarray, vmax: float) -> np.ndarray:
     return out
 
 
-def scale_0_to_vmax_power(a: np.ndarray, vmax: float, gamma: float = 0.5) -> np.ndarray:
+def scale_0_to_vmax_power_into(a: np.ndarray, out: np.ndarray, vmax: float, gamma: float = 0.5,
+                               finite_mask: np.ndarray | None = None) -> np.ndarray:
+    """
+    Like scale_0_to_vmax_power, but writes into `out` (e.g. one channel view of an RGBA buffer).
+    Pass `finite_mask` (np.isfinite(a)) if the caller already has it, to skip recomputing it.
+    """
     a = a.astype(np.float32, copy=False)
-    out = np.zeros_like(a, dtype=np.uint8)
 
     if not np.isfinite(vmax) or vmax <= 0:
+        out[...] = 0
         return out
 
-    scaled = np.clip(a / float(vmax), 0.0, 1.0)
-    scaled = np.power(scaled, float(gamma))
-    out = (scaled * 255.0).astype(np.uint8)
-    out[~np.isfinite(a)] = 0
+    if finite_mask is None:
+        finite_mask = np.isfinite(a)
+
+    # One float32 scratch buffer per call; the last step writes straight into the uint8 output.
+    if gamma == 1.0:
+        # Linear: scale to 0..255 and saturate in one go
+        scaled = np.multiply(a, np.float32(255.0 / vmax))
+        np.clip(scaled, 0.0, 255.0, out=scaled)
+        scaled[~finite_mask] = 0.0
+        np.copyto(out, scaled, casting="unsafe")
+    elif gamma == 0.5:
+        # sqrt is much cheaper than the general pow() for the default gamma
+        scaled = np.multiply(a, np.float32(1.0 / vmax))
+        np.clip(scaled, 0.0, 1.0, out=scaled)
+        np.sqrt(scaled, out=scaled)
+        scaled[~finite_mask] = 0.0
+        np.multiply(scaled, 255.0, out=out, casting="unsafe")
+    else:
+        # Any other gamma: normalize to [0, 1] and apply the power law in place
+        scaled = np.divide(a, float(vmax))
+        np.clip(scaled, 0.0, 1.0, out=scaled)
+        np.power(scaled, gamma, out=scaled)
+        scaled[~finite_mask] = 0.0  # mask invalid input
+        np.multiply(scaled, 255.0, out=out, casting="unsafe")
     return out
 
 
-def encode_evap_precip_png(evap_pos: np.ndarray, precip: np.ndarray, vmax: float, gamma: float) -> bytes:
-    r = scale_0_to_vmax_power(evap_pos, vmax, gamma=gamma)
-    g = np.zeros_like(r, dtype=np.uint8)
-    b = scale_0_to_vmax_power(precip, vmax, gamma=gamma)
-    a = np.full_like(r, 255, dtype=np.uint8)
-
-    rgba = np.dstack([r, g, b, a])
-    img = Image.fromarray(rgba, mode="RGBA")
+def scale_0_to_vmax_power(a: np.ndarray, vmax: float, gamma: float = 0.5,
+                          finite_mask: np.ndarray | None = None) -> np.ndarray:
+    out = np.empty(a.shape, dtype=np.uint8)
+    return scale_0_to_vmax_power_into(a, out, vmax, gamma=gamma, finite_mask=finite_mask)
+
+
+def encode_evap_precip_png(evap_pos: np.ndarray, precip: np.ndarray, vmax: float, gamma: float,
+                           rows: slice = slice(None),
+                           evap_finite: np.ndarray | None = None,
+                           precip_finite: np.ndarray | None = None,
+                           rgba_out: np.ndarray | None = None) -> bytes:
+    # Build the RGBA buffer once and scale each field straight into its channel (no dstack copy).
+    # `rows` orders the output rows (see _north_up_rows), so the inputs never need flipping.
+    # `evap_finite` / `precip_finite` are optional precomputed np.isfinite masks of the inputs.
+    # Pass `rgba_out` to reuse one HxWx4 buffer across calls (e.g. when rendering many frames).
+    shape = (*evap_pos.shape, 4)
+    if rgba_out is None:
+        rgba = np.empty(shape, dtype=np.uint8)
+    elif rgba_out.shape != shape or rgba_out.dtype != np.uint8 or not rgba_out.flags.c_contiguous:
+        raise ValueError(f"rgba_out must be a C-contiguous uint8 array of shape {shape}")
+    else:
+        rgba = rgba_out
+    scale_0_to_vmax_power_into(evap_pos, rgba[rows, :, 0], vmax, gamma=gamma, finite_mask=evap_finite)
+    rgba[..., 1].fill(0)
+    scale_0_to_vmax_power_into(precip, rgba[rows, :, 2], vmax, gamma=gamma, finite_mask=precip_finite)
+    rgba[..., 3].fill(255)
+
+    # rgba is C-contiguous, so PIL can wrap its memory directly instead of copying it
+    h, w = rgba.shape[:2]
+    img = Image.frombuffer("RGBA", (w, h), rgba, "raw", "RGBA", 0, 1)
 
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
+    img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
     buf.seek(0)
     return buf.read()
 
 
-def _maybe_flip_for_north_up(ds: xr.Dataset, a: np.ndarray) -> np.ndarray:
+def _north_up_rows(ds: xr.Dataset) -> slice:
     """
-    PIL row 0 is top. If latitude increases south->north, north is at bottom -> flipud.
-    If latitude decreases north->south, already north-up -> no flip.
+    PIL row 0 is top. If latitude increases south->north, north is at bottom -> reversed rows.
+    If latitude decreases north->south, already north-up -> rows as-is.
     """
     for lat_name in ["latitude", "lat", "y"]:
         if lat_name in ds.coords and ds[lat_name].ndim == 1:
             latv = ds[lat_name].values
             if latv.size >= 2 and (latv[1] - latv[0]) > 0:
-                return np.flipud(a)
-            return a
-    return a
+                return slice(None, None, -1)
+            return slice(None)
+    return slice(None)
 
 
 def main():
@@ -105,27 +156,31 @@ def main():
     # Convert ERA5 convention: evaporation often negative for upward flux.
     evap_pos = (-1.0) * e_mean
 
-    # Clip to nonnegative “amounts”
-    evap_pos = np.where(np.isfinite(evap_pos), np.maximum(evap_pos, 0.0), np.nan).astype(np.float32)
-    precip = np.where(np.isfinite(tp_mean), np.maximum(tp_mean, 0.0), np.nan).astype(np.float32)
-
-    # Shared robust vmax across both fields
-    combo = np.concatenate([evap_pos[np.isfinite(evap_pos)].ravel(),
-                            precip[np.isfinite(precip)].ravel()])
-    if combo.size == 0:
+    # Clip to nonnegative “amounts” in place (NaN passes through np.maximum unchanged)
+    np.maximum(evap_pos, 0.0, out=evap_pos)
+    precip = np.maximum(tp_mean, 0.0, out=tp_mean)
+
+    # Shared robust vmax across both fields: per-field 99th percentile, take the larger.
+    # Close to the pooled percentile for a color cap, without concatenating the fields.
+    # The finite masks are computed once here and reused by the encoder.
+    evap_finite = np.isfinite(evap_pos)
+    precip_finite = np.isfinite(precip)
+    finite_evap = evap_pos[evap_finite]
+    finite_precip = precip[precip_finite]
+    if finite_evap.size == 0 and finite_precip.size == 0:
         raise ValueError("No finite values found in mean fields.")
 
-    vmax = float(np.nanpercentile(combo, 99))
+    vmax = max(partition_percentile(v, 99) for v in (finite_evap, finite_precip) if v.size)
     vmax = max(vmax, 1e-9)
 
     # Gamma boost for low values (tweak if you want)
     GAMMA = 0.5
 
-    # Flip for north-up display if needed
-    evap_pos = _maybe_flip_for_north_up(ds, evap_pos)
-    precip = _maybe_flip_for_north_up(ds, precip)
+    # Flip for north-up display if needed: the encoder writes rows in this order
+    rows = _north_up_rows(ds)
 
-    png_bytes = encode_evap_precip_png(evap_pos, precip, vmax=vmax, gamma=GAMMA)
+    png_bytes = encode_evap_precip_png(evap_pos, precip, vmax=vmax, gamma=GAMMA, rows=rows,
+                                       evap_finite=evap_finite, precip_finite=precip_finite)
 
     with open(out_png, "wb") as f:
         f.write(png_bytes)
@@ -133,7 +188,7 @@ def main():
     print(f"Wrote PNG: {out_png}")
     print(f"Evap+ (after *-1, clipped>=0) min/max: [{float(np.nanmin(evap_pos)):.6g}, {float(np.nanmax(evap_pos)):.6g}]")
     print(f"Precip (clipped>=0)         min/max: [{float(np.nanmin(precip)):.6g}, {float(np.nanmax(precip)):.6g}]")
-    print(f"Shared color scale vmax (99th pct of both): {vmax:.6g}")
+    print(f"Shared color scale vmax (max of per-field 99th pct): {vmax:.6g}")
     print(f"Gamma (power-law): {GAMMA}")
     print("Color mapping: Red=evaporation, Blue=precipitation (same 0..vmax scale).")
 
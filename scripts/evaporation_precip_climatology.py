@@ -1,11 +1,17 @@
 import io
 import os
+import dask
 import numpy as np
 import xarray as xr
 from PIL import Image
 from dask.diagnostics import ProgressBar
 from pathlib import Path
 from dotenv import load_dotenv
+from color_scale import partition_percentile
+
+# PNG is lossless at every level; 1 trades a slightly larger file for a much faster encode.
+PNG_COMPRESS_LEVEL = 1
+
 
 def resolve_paths():
     load_dotenv()
@@ -20,10 +26,46 @@ def resolve_paths():
     return in_nc, out_png
 
 
-def open_dataset(path: str, time_chunk: int = 64) -> xr.Dataset:
+# Rough size of one dask chunk when growing on-disk chunks along time (dask's own default is 128 MiB)
+TARGET_CHUNK_BYTES = 100 * 2**20
+
+
+def _disk_aligned_chunks(ds: xr.Dataset, target_bytes: int = TARGET_CHUNK_BYTES) -> dict[str, int]:
+    """
+    Dask chunks that are whole multiples of the NetCDF on-disk chunks, so every stored chunk is
+    read and decompressed by exactly one task. Non-time dims keep their on-disk size; the time dim
+    grows by an integer factor until a chunk holds ~target_bytes. Empty if nothing is chunked on disk.
+    """
+    for da in ds.data_vars.values():
+        disk = da.encoding.get("chunksizes")
+        if not disk or len(disk) != da.ndim:
+            continue
+        chunks = dict(zip(da.dims, disk))
+        time_dim = _get_time_dim(da)
+        if time_dim is not None:
+            chunk_bytes = da.dtype.itemsize * int(np.prod(disk))
+            k = max(1, target_bytes // chunk_bytes)
+            chunks[time_dim] = min(chunks[time_dim] * k, da.sizes[time_dim])
+        return chunks
+    return {}
+
+
+def open_dataset(path: str, time_chunk: int = 128, lat_chunk: int = 361, lon_chunk: int = 720) -> xr.Dataset:
     if not os.path.exists(path):
         raise FileNotFoundError(f"NetCDF file not found: {path}")
-    return xr.open_dataset(path, chunks={"time": time_chunk}, decode_times=False)
+    # Follow the file's own chunk layout, so no stored chunk is decompressed by several tasks.
+    # The time/lat/lon tiling is only the fallback for files stored contiguously (no on-disk chunks);
+    # dims missing from the file are ignored.
+    with xr.open_dataset(path, decode_times=False) as probe:
+        chunks = _disk_aligned_chunks(probe)
+    if not chunks:
+        chunks = {
+            "time": time_chunk,
+            "valid_time": time_chunk,
+            "latitude": lat_chunk,
+            "longitude": lon_chunk,
+        }
+    return xr.open_dataset(path, chunks=chunks, decode_times=False)
 
 
 def pick_var_name(ds: xr.Dataset, candidates: list[str]) -> str:
@@ -64,8 +106,11 @@ def select_component(ds: xr.Dataset, var_name: str) -> xr.DataArray:
     # Make sure latitude is ascending (south->north) for predictable flipping later
     lat_name = _get_lat_name(da)
     if lat_name is not None:
-        latv = da[lat_name].values
-        if np.any(np.diff(latv) < 0):
+        dlat = np.diff(da[lat_name].values)
+        if dlat.size and np.all(dlat < 0):
+            # Descending (ERA5 north->south): a lazy reversed isel, no sortby reindex of the whole array
+            da = da.isel({lat_name: slice(None, None, -1)})
+        elif np.any(dlat < 0):
             da = da.sortby(lat_name)
 
     return da
@@ -82,7 +127,8 @@ def scale_0_to_vmax(a: np.ndarray, vmax: float) -> np.ndarray:
     out[~np.isfinite(a)] = 0
     return out
 
-def scale_0_to_vmax_power(a: np.ndarray, vmax: float, gamma: float = 0.5) -> np.ndarray:
+def scale_0_to_vmax_power(a: np.ndarray, vmax: float, gamma: float = 0.5,
+                          finite_mask: np.ndarray | None = None) -> np.ndarray:
     """
     Scale array to 0..255 using a power-law (gamma < 1 boosts low values).
 
@@ -95,46 +141,92 @@ def scale_0_to_vmax_power(a: np.ndarray, vmax: float, gamma: float = 0.5) -> np.
     gamma : float
         Power-law exponent. <1 boosts inland / low values.
         Typical: 0.4–0.6
+    finite_mask : np.ndarray, optional
+        Precomputed np.isfinite(a), if the caller already has it.
+    """
+    out = np.empty(a.shape, dtype=np.uint8)
+    return scale_0_to_vmax_power_into(a, out, vmax, gamma=gamma, finite_mask=finite_mask)
+
+
+def scale_0_to_vmax_power_into(a: np.ndarray, out: np.ndarray, vmax: float, gamma: float = 0.5,
+                               finite_mask: np.ndarray | None = None) -> np.ndarray:
+    """
+    Same as scale_0_to_vmax_power, but writes the 8-bit result into `out`
+    (e.g. a single channel view of a preallocated RGBA buffer).
     """
     a = a.astype(np.float32, copy=False)
-    out = np.zeros_like(a, dtype=np.uint8)
 
     if not np.isfinite(vmax) or vmax <= 0:
+        out[...] = 0
         return out
 
-    # Normalize to [0, 1]
-    scaled = np.clip(a / float(vmax), 0.0, 1.0)
-
-    # Power-law (gamma) transform
-    scaled = np.power(scaled, gamma)
-
-    # Map to 8-bit
-    out = (scaled * 255.0).astype(np.uint8)
-
-    # Mask invalid input
-    out[~np.isfinite(a)] = 0
+    if finite_mask is None:
+        finite_mask = np.isfinite(a)
+
+    # Each path reuses one float32 scratch buffer and writes straight into the uint8 output.
+    if gamma == 1.0:
+        # Linear: scale to 0..255 and saturate in one go, no separate normalize / *255 steps
+        scaled = np.multiply(a, np.float32(255.0 / vmax))
+        np.clip(scaled, 0.0, 255.0, out=scaled)
+        scaled[~finite_mask] = 0.0  # mask invalid input
+        np.copyto(out, scaled, casting="unsafe")
+    elif gamma == 0.5:
+        # Normalize to [0, 1], then sqrt (far cheaper than the general pow()) for the default gamma
+        scaled = np.multiply(a, np.float32(1.0 / vmax))
+        np.clip(scaled, 0.0, 1.0, out=scaled)
+        np.sqrt(scaled, out=scaled)
+        scaled[~finite_mask] = 0.0  # mask invalid input
+        np.multiply(scaled, 255.0, out=out, casting="unsafe")
+    else:
+        # Any other gamma: normalize to [0, 1] and apply the power law in place
+        scaled = np.divide(a, float(vmax))
+        np.clip(scaled, 0.0, 1.0, out=scaled)
+        np.power(scaled, gamma, out=scaled)
+        scaled[~finite_mask] = 0.0  # mask invalid input
+        np.multiply(scaled, 255.0, out=out, casting="unsafe")
     return out
 
 
+def encode_evap_precip_png(evap_pos: np.ndarray, precip: np.ndarray, vmax: float,
+                           rows: slice = slice(None),
+                           evap_finite: np.ndarray | None = None,
+                           precip_finite: np.ndarray | None = None,
+                           rgba_out: np.ndarray | None = None,
+                           include_red: bool = True,
+                           include_blue: bool = True) -> bytes:
+    # Red = evaporation, Blue = precip, same scale.
+    # include_red / include_blue = False leave that channel black and skip its scale pass entirely.
+    # Each channel is written in place into one RGBA buffer (no per-channel arrays + dstack copy).
+    # `rows` orders the output rows, e.g. slice(None, None, -1) to flip without copying the inputs.
+    # Pass `rgba_out` to reuse one HxWx4 buffer across calls instead of allocating per call.
+    shape = (*evap_pos.shape, 4)
+    if rgba_out is None:
+        rgba = np.empty(shape, dtype=np.uint8)
+    elif rgba_out.shape != shape or rgba_out.dtype != np.uint8 or not rgba_out.flags.c_contiguous:
+        raise ValueError(f"rgba_out must be a C-contiguous uint8 array of shape {shape}")
+    else:
+        rgba = rgba_out
 
-def encode_evap_precip_png(evap_pos: np.ndarray, precip: np.ndarray, vmax: float) -> bytes:
-    # Red = evaporation, Blue = precip, same scale
-
-    r = scale_0_to_vmax_power(evap_pos, vmax)
-    r = np.zeros_like(r, dtype=np.uint8)
+    if include_red:
+        scale_0_to_vmax_power_into(evap_pos, rgba[rows, :, 0], vmax, finite_mask=evap_finite)
+    else:
+        rgba[..., 0].fill(0)
 
-    g = np.zeros_like(r, dtype=np.uint8)
+    rgba[..., 1].fill(0)
 
-    b = scale_0_to_vmax_power(precip, vmax)
-    # b = np.zeros_like(r, dtype=np.uint8)
+    if include_blue:
+        scale_0_to_vmax_power_into(precip, rgba[rows, :, 2], vmax, finite_mask=precip_finite)
+    else:
+        rgba[..., 2].fill(0)
 
-    a = np.full_like(r, 255, dtype=np.uint8)
+    rgba[..., 3].fill(255)
 
-    rgba = np.dstack([r, g, b, a])
-    img = Image.fromarray(rgba, mode="RGBA")
+    # rgba is C-contiguous, so PIL can wrap its memory directly instead of copying it
+    h, w = rgba.shape[:2]
+    img = Image.frombuffer("RGBA", (w, h), rgba, "raw", "RGBA", 0, 1)
 
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
+    img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
     buf.seek(0)
     return buf.read()
 
@@ -142,7 +234,11 @@ def encode_evap_precip_png(evap_pos: np.ndarray, precip: np.ndarray, vmax: float
 def main():
     nc_path, out_png = resolve_paths()
 
-    TIME_CHUNK = 64
+    # Chunks follow the file's on-disk layout (see open_dataset / TARGET_CHUNK_BYTES);
+    # TIME_CHUNK only sizes the time/lat/lon tiles used for contiguous files.
+    TIME_CHUNK = 128
+    # The mean is numpy-bound and releases the GIL, so threads beat processes here.
+    dask.config.set(scheduler="threads")
     ds = open_dataset(nc_path, time_chunk=TIME_CHUNK)
 
     # Common ERA5 names:
@@ -153,62 +249,59 @@ def main():
 
     ds = ds[[evap_name, precip_name]]
 
-    evap_da = select_component(ds, evap_name)
-    precip_da = select_component(ds, precip_name)
+    # Pin float32 on the lazy arrays so the reduction never promotes to float64
+    # and the computed means need no out-of-place cast afterwards.
+    evap_da = select_component(ds, evap_name).astype(np.float32)
+    precip_da = select_component(ds, precip_name).astype(np.float32)
 
     time_dim = _get_time_dim(evap_da)
 
     if time_dim is None:
-        evap_mean = evap_da.values.astype(np.float32)
-        precip_mean = precip_da.values.astype(np.float32)
+        evap_mean_da = evap_da
+        precip_mean_da = precip_da
         n_times = 1
     else:
-        if time_dim != "time":
-            evap_da = evap_da.chunk({time_dim: TIME_CHUNK})
-            precip_da = precip_da.chunk({time_dim: TIME_CHUNK})
-
-        print("Computing dask mean for evaporation...")
         evap_mean_da = evap_da.mean(dim=time_dim, skipna=True)
-
-        print("Computing dask mean for precipitation...")
         precip_mean_da = precip_da.mean(dim=time_dim, skipna=True)
-
-        with ProgressBar():
-            evap_mean = evap_mean_da.compute().values.astype(np.float32, copy=False)
-        with ProgressBar():
-            precip_mean = precip_mean_da.compute().values.astype(np.float32, copy=False)
-
         n_times = int(evap_da.sizes.get(time_dim, 0))
 
-    if evap_mean.ndim != 2 or precip_mean.ndim != 2:
+    if evap_mean_da.ndim != 2 or precip_mean_da.ndim != 2:
         raise RuntimeError(
-            f"Unexpected mean shapes: evap={evap_mean.shape}, precip={precip_mean.shape} (expected 2D)"
+            f"Unexpected mean shapes: evap={evap_mean_da.shape}, precip={precip_mean_da.shape} (expected 2D)"
         )
 
     # ERA5 evaporation is often negative for evaporation (upward flux).
-    evap_pos = (-1.0) * evap_mean
+    # Sanity: clip tiny negatives to 0 so the color intensity means “amount” (NaN passes through).
+    # Both stay lazy, so dask clips each chunk right after reducing it and only the final
+    # clipped grids are materialized, from a single compute that reads every input chunk once.
+    evap_pos_da = (-evap_mean_da).clip(min=0.0)
+    precip_pos_da = precip_mean_da.clip(min=0.0)
 
-    # Sanity: clip tiny negatives to 0 so the color intensity means “amount”
-    evap_pos = np.where(np.isfinite(evap_pos), np.maximum(evap_pos, 0.0), np.nan).astype(np.float32)
-    precip_mean = np.where(np.isfinite(precip_mean), np.maximum(precip_mean, 0.0), np.nan).astype(np.float32)
+    print("Computing dask means for evaporation and precipitation...")
+    with ProgressBar():
+        evap_pos_da, precip_pos_da = dask.compute(evap_pos_da, precip_pos_da)
+
+    evap_pos = evap_pos_da.to_numpy()
+    precip_mean = precip_pos_da.to_numpy()
 
     # Choose a shared scale [0 .. vmax] for both.
-    # Robust: 99th percentile of the combined fields (after mean), so outliers don’t blow the map.
-    combo = np.concatenate(
-        [evap_pos[np.isfinite(evap_pos)].ravel(), precip_mean[np.isfinite(precip_mean)].ravel()]
-    )
-    if combo.size == 0:
+    # Robust: larger of the two fields' 99th percentiles (after mean), so outliers don’t blow the map.
+    # Close to the pooled percentile for a color cap, without concatenating the fields.
+    # Finite masks are computed once and reused by the encoder.
+    evap_finite = np.isfinite(evap_pos)
+    precip_finite = np.isfinite(precip_mean)
+    finite_evap = evap_pos[evap_finite]
+    finite_precip = precip_mean[precip_finite]
+    if finite_evap.size == 0 and finite_precip.size == 0:
         raise ValueError("No finite values found in evaporation/precipitation means.")
 
-    vmax = float(np.nanpercentile(combo, 99))
+    vmax = max(partition_percentile(v, 99) for v in (finite_evap, finite_precip) if v.size)
     vmax = max(vmax, 1e-9)
 
     # Flip for PNG so north is at the top.
-    # We sorted latitude to ascending (south->north), so flipud puts north on top.
-    evap_pos = np.flipud(evap_pos)
-    precip_mean = np.flipud(precip_mean)
-
-    png_bytes = encode_evap_precip_png(evap_pos, precip_mean, vmax)
+    # We sorted latitude to ascending (south->north), so writing rows in reverse puts north on top.
+    png_bytes = encode_evap_precip_png(evap_pos, precip_mean, vmax, rows=slice(None, None, -1),
+                                       evap_finite=evap_finite, precip_finite=precip_finite)
     with open(out_png, "wb") as f:
         f.write(png_bytes)
 
@@ -218,7 +311,7 @@ def main():
     # Print min/max (post-processing, pre-scale), so you can sanity-check magnitudes.
     print(f"Evap mean (after *-1, clipped>=0) min/max: [{float(np.nanmin(evap_pos)):.6g}, {float(np.nanmax(evap_pos)):.6g}]")
     print(f"Precip mean (clipped>=0)         min/max: [{float(np.nanmin(precip_mean)):.6g}, {float(np.nanmax(precip_mean)):.6g}]")
-    print(f"Shared color scale vmax (99th pct of both): {vmax:.6g}")
+    print(f"Shared color scale vmax (max of per-field 99th pct): {vmax:.6g}")
     print("Color mapping: Red=evaporation, Blue=precipitation (same 0..vmax scale).")
 
 
@@ -1,4 +1,5 @@
 import os
+import dask
 import numpy as np
 import xarray as xr
 from dask.diagnostics import ProgressBar
@@ -46,6 +47,16 @@ def _get_time_dim(da: xr.DataArray) -> str | None:
     return None
 
 
+def _sample_has_nan(da: xr.DataArray, time_dim: str) -> bool:
+    """
+    Whether the first time step contains NaN. Used to choose skipna for the time mean: the
+    NaN-skipping reduction is ~2x slower, and ERA5 pressure-level winds (extrapolated below
+    ground) have no missing points. The encoding's _FillValue is no hint, since CDS and
+    xarray declare one (NaN) on every float variable.
+    """
+    return bool(np.isnan(da.isel({time_dim: 0}).values).any())
+
+
 def select_level_component(ds: xr.Dataset, var_name: str, level_hpa: int) -> xr.DataArray:
     if var_name not in ds.variables:
         raise KeyError(f"Variable '{var_name}' not found in dataset")
@@ -62,8 +73,11 @@ def select_level_component(ds: xr.Dataset, var_name: str, level_hpa: int) -> xr.
     # Keep latitude increasing (south->north) so output is consistent
     for lat_name in ["latitude", "lat"]:
         if lat_name in da.coords and da[lat_name].ndim == 1:
-            latv = da[lat_name].values
-            if np.any(np.diff(latv) < 0):
+            dlat = np.diff(da[lat_name].values)
+            if dlat.size and np.all(dlat < 0):
+                # Descending (ERA5 north->south): a lazy reversed isel, no sortby reindex of the whole array
+                da = da.isel({lat_name: slice(None, None, -1)})
+            elif np.any(dlat < 0):
                 da = da.sortby(lat_name)  # ascending
             break
 
@@ -96,13 +110,17 @@ def main():
             u_da = u_da.chunk({time_dim: TIME_CHUNK})
             v_da = v_da.chunk({time_dim: TIME_CHUNK})
 
-        u_mean_da = u_da.mean(dim=time_dim, skipna=True)
-        v_mean_da = v_da.mean(dim=time_dim, skipna=True)
+        # float32 end to end (no float64 promotion), and only pay for NaN skipping if there are NaNs
+        u_da = u_da.astype(np.float32)
+        v_da = v_da.astype(np.float32)
+        skipna = _sample_has_nan(u_da, time_dim) or _sample_has_nan(v_da, time_dim)
 
+        u_mean_da = u_da.mean(dim=time_dim, skipna=skipna)
+        v_mean_da = v_da.mean(dim=time_dim, skipna=skipna)
+
+        # Compute both together so dask reads each shared input chunk once, not twice
         with ProgressBar():
-            u_mean = u_mean_da.compute().astype(np.float32)
-        with ProgressBar():
-            v_mean = v_mean_da.compute().astype(np.float32)
+            u_mean, v_mean = dask.compute(u_mean_da, v_mean_da)
 
         n_times = int(u_da.sizes.get(time_dim, 0))
 
@@ -9,6 +9,29 @@ import xarray as xr
 from PIL import Image
 
 
+# Extra LUT row for land / NaN cells (black)
+SST_NAN_INDEX = 256
+
+
+def build_sst_lut() -> np.ndarray:
+    """
+    RGB table indexed by the quantized normalized temperature (t * 255).
+      cold (t=0)  -> blue
+      hot  (t=1)  -> red
+    Row SST_NAN_INDEX is black, for land / NaN.
+    """
+    t = np.arange(256, dtype=np.float32) / 255.0
+    lut = np.zeros((SST_NAN_INDEX + 1, 3), dtype=np.uint8)
+    ramp = lut[:256]
+    ramp[:, 0] = np.arange(256)
+    ramp[:, 1] = (255 * (1.0 - np.abs(2.0 * t - 1.0))).astype(np.uint8)
+    ramp[:, 2] = 255 - ramp[:, 0]
+    return lut
+
+
+SST_LUT = build_sst_lut()
+
+
 def main():
     if len(sys.argv) != 3:
         print("Usage: python era5_mean_sst_to_rgb.py input.nc out.png")
@@ -29,28 +52,25 @@ def main():
     mean_sst = da.mean(dim="valid_time", skipna=True)
     arr = mean_sst.values.astype(np.float32)
 
-    # Robust normalization
-    finite = arr[np.isfinite(arr)]
-    lo = np.quantile(finite, 0.01)
-    hi = np.quantile(finite, 0.99)
-
-    t = (arr - lo) / (hi - lo)
-    t = np.clip(t, 0.0, 1.0)
+    # Robust normalization: 1st/99th percentiles from a single linear-time partition
+    # (nearest lower rank) instead of two full sorts via np.quantile.
+    finite_mask = np.isfinite(arr)
+    finite = arr[finite_mask]
+    k_lo = int(0.01 * (finite.size - 1))
+    k_hi = int(0.99 * (finite.size - 1))
+    finite.partition([k_lo, k_hi])
+    lo = float(finite[k_lo])
+    hi = float(finite[k_hi])
 
     # ---- RGB mapping ----
-    # cold (t=0)  -> blue
-    # hot  (t=1)  -> red
-    r = (255 * t).astype(np.uint8)
-    g = (255 * (1.0 - np.abs(2.0 * t - 1.0))).astype(np.uint8)
-    b = (255 * (1.0 - t)).astype(np.uint8)
-
-    # Land / NaN -> black
-    nanmask = ~np.isfinite(arr)
-    r[nanmask] = 0
-    g[nanmask] = 0
-    b[nanmask] = 0
-
-    rgb = np.stack([r, g, b], axis=-1)
+    # Quantize once to a 0..255 index, then look up all three channels in SST_LUT.
+    # Land / NaN -> black via the SST_NAN_INDEX row, so the lookup writes the final image in one pass.
+    # A (near-)constant field has hi == lo: map it all to the bottom of the ramp instead of dividing by zero.
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    idx = (arr - lo) * scale
+    np.clip(idx, 0.0, 255.0, out=idx)
+    idx[~finite_mask] = SST_NAN_INDEX
+    rgb = SST_LUT[idx.astype(np.uint16)]
 
     Image.fromarray(rgb, mode="RGB").save(out_path)
 
@@ -1,5 +1,6 @@
 import io
 import os
+import dask
 import numpy as np
 import xarray as xr
 from PIL import Image
@@ -7,6 +8,10 @@ from dask.diagnostics import ProgressBar
 from dotenv import load_dotenv
 from pathlib import Path
 
+# PNG is lossless at every level; 3 encodes several times faster than Pillow's default 6 for slightly larger files.
+PNG_COMPRESS_LEVEL = 3
+
+
 def resolve_paths():
     load_dotenv()
 
@@ -21,14 +26,46 @@ def resolve_paths():
     return nc_path, out_png
 
 
+# Rough size of one dask chunk when growing on-disk chunks along time (dask's own default is 128 MiB)
+TARGET_CHUNK_BYTES = 100 * 2**20
+
+
+def _disk_aligned_chunks(ds: xr.Dataset, target_bytes: int = TARGET_CHUNK_BYTES) -> dict[str, int]:
+    """
+    Dask chunks that are whole multiples of the NetCDF on-disk chunks, so every stored chunk is
+    read and decompressed by exactly one task. Non-time dims keep their on-disk size; the time dim
+    grows by an integer factor until a chunk holds ~target_bytes. Empty if nothing is chunked on disk.
+    """
+    for da in ds.data_vars.values():
+        disk = da.encoding.get("chunksizes")
+        if not disk or len(disk) != da.ndim:
+            continue
+        chunks = dict(zip(da.dims, disk))
+        time_dim = _get_time_dim(da)
+        if time_dim is not None:
+            chunk_bytes = da.dtype.itemsize * int(np.prod(disk))
+            k = max(1, target_bytes // chunk_bytes)
+            chunks[time_dim] = min(chunks[time_dim] * k, da.sizes[time_dim])
+        return chunks
+    return {}
+
+
 def open_dataset(path: str, time_chunk: int = 32) -> xr.Dataset:
     if not os.path.exists(path):
         raise FileNotFoundError(f"ERA5 NetCDF file not found: {path}")
 
-    # Chunk over time so dask can stream + parallelize without loading everything.
+    # Follow the file's own chunk layout. A fixed {"time": N} that cuts across the stored chunks
+    # (e.g. spatially tiled ERA5 files, or N not a multiple of the stored time chunk) makes several
+    # tasks decompress the same disk chunk, multiplying IO and peak memory.
+    # time_chunk is only the fallback for files stored contiguously (no on-disk chunks).
+    with xr.open_dataset(path, decode_times=False) as probe:
+        chunks = _disk_aligned_chunks(probe)
+    if not chunks:
+        chunks = {"time": time_chunk, "valid_time": time_chunk}
+
     # decode_times=False can be a small speed win if you never use actual datetimes.
     # Keep decode_times=True if you prefer; either works for mean.
-    ds = xr.open_dataset(path, chunks={"time": time_chunk}, decode_times=False)
+    ds = xr.open_dataset(path, chunks=chunks, decode_times=False)
 
     return ds
 
@@ -56,23 +93,36 @@ def select_level_component(ds: xr.Dataset, var_name: str, level_hpa: int) -> xr.
     # Keep latitude increasing (south->north) for consistent output
     for lat_name in ["latitude", "lat"]:
         if lat_name in da.coords and da[lat_name].ndim == 1:
-            latv = da[lat_name].values
-            if np.any(np.diff(latv) < 0):
+            dlat = np.diff(da[lat_name].values)
+            if dlat.size and np.all(dlat < 0):
+                # Descending (ERA5 north->south): a lazy reversed isel, no sortby reindex of the whole array
+                da = da.isel({lat_name: slice(None, None, -1)})
+            elif np.any(dlat < 0):
                 da = da.sortby(lat_name)
             break
 
     return da
 
 
-def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Linearly map [vmin, vmax] to 0..255 (clipped); NaN -> 0.
+    Pass `out` (e.g. one channel view of an RGBA buffer) to write into it instead of allocating.
+    """
     a = a.astype(np.float32, copy=False)
-    out = np.zeros_like(a, dtype=np.uint8)
+    if out is None:
+        out = np.empty(a.shape, dtype=np.uint8)
     if not np.isfinite(vmin) or not np.isfinite(vmax) or vmax <= vmin:
+        out[...] = 0
         return out
-    scaled = (a - vmin) / (vmax - vmin)
-    scaled = np.clip(scaled * 255.0, 0.0, 255.0)
-    out = scaled.astype(np.uint8)
-    out[~np.isfinite(a)] = 0
+
+    # One float32 scratch buffer, updated in place. fmax (unlike clip/maximum) returns the
+    # non-NaN operand, so the lower clamp also zeroes NaN and no separate isfinite pass is needed.
+    scaled = np.subtract(a, np.float32(vmin))
+    np.multiply(scaled, np.float32(255.0 / (vmax - vmin)), out=scaled)
+    np.fmax(scaled, 0.0, out=scaled)
+    np.minimum(scaled, 255.0, out=scaled)
+    np.copyto(out, scaled, casting="unsafe")
     return out
 
 
@@ -83,86 +133,41 @@ UV_RANGES_MPS = {
 }
 
 
-def encode_uv_avg_rgb_png(u_mean: np.ndarray, v_mean: np.ndarray, pressure_level: int) -> bytes:
+def encode_uv_avg_rgb_png(u_mean: np.ndarray, v_mean: np.ndarray, pressure_level: int,
+                          fmt: str = "PNG") -> bytes:
+    """
+    Encode U -> red, V -> green (fixed ranges per level) as an image.
+    fmt="PNG" (default) or "WEBP" (lossless, fastest effort setting) for web viewers that accept it.
+    """
     if pressure_level not in UV_RANGES_MPS:
         raise ValueError(f"Unsupported pressure level for fixed ranges: {pressure_level}")
 
     umin, umax = UV_RANGES_MPS[pressure_level]
     vmin, vmax = UV_RANGES_MPS[pressure_level]
 
-    r = scale_fixed_range(u_mean, umin, umax)
-    g = scale_fixed_range(v_mean, vmin, vmax)
-    b = np.zeros_like(r, dtype=np.uint8)
-    a = np.full_like(r, 255, dtype=np.uint8)
+    # Scale each component straight into its channel of one contiguous RGBA buffer
+    rgba = np.empty((*u_mean.shape, 4), dtype=np.uint8)
+    scale_fixed_range(u_mean, umin, umax, out=rgba[..., 0])
+    scale_fixed_range(v_mean, vmin, vmax, out=rgba[..., 1])
+    rgba[..., 2].fill(0)
+    rgba[..., 3].fill(255)
 
-    rgba = np.dstack([r, g, b, a])
-    image = Image.fromarray(rgba, mode="RGBA")
+    # rgba is C-contiguous, so PIL can wrap its memory directly instead of copying it
+    h, w = rgba.shape[:2]
+    image = Image.frombuffer("RGBA", (w, h), rgba, "raw", "RGBA", 0, 1)
     buf = io.BytesIO()
-    image.save(buf, format="PNG")
+    if fmt == "PNG":
+        image.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt == "WEBP":
+        # In lossless mode quality is encoder effort: 0 with method=0 is the fastest setting.
+        # Alpha is constant 255, so decoders may hand the image back as RGB.
+        image.save(buf, format="WEBP", lossless=True, method=0, quality=0)
+    else:
+        raise ValueError(f"Unsupported image format: {fmt} (expected 'PNG' or 'WEBP')")
     buf.seek(0)
     return buf.read()
 
 
-def uv850_to_hue_value_rgba(u: np.ndarray, v: np.ndarray,
-                           vmax_mps: float = 60.0,
-                           sat: float = 0.8,
-                           gamma: float = 0.7,
-                           calm_mps: float = 0.8) -> np.ndarray:
-    """
-    850 hPa wind visualization:
-      Hue   = direction atan2(v,u)
-      Value = speed normalized by vmax_mps (clipped), with gamma compression
-      Sat   = constant sat
-      Calm  = speeds below calm_mps set to black (no hue noise)
-
-    Returns RGBA uint8 image (H,W,4).
-    """
-    u = u.astype(np.float32)
-    v = v.astype(np.float32)
-
-    spd = np.sqrt(u*u + v*v)
-    theta = np.arctan2(v, u)                 # [-pi, pi]
-    h = (theta + np.pi) / (2.0 * np.pi)      # [0, 1)
-
-    # Value from speed (fixed scale)
-    val = np.clip(spd / float(vmax_mps), 0.0, 1.0)
-    val = np.power(val, float(gamma))
-
-    # Calm masking
-    val = np.where(spd < float(calm_mps), 0.0, val)
-    s = np.where(val > 0.0, float(sat), 0.0).astype(np.float32)
-
-    # HSV -> RGB (vectorized)
-    i = np.floor(h * 6.0).astype(np.int32) % 6
-    f = (h * 6.0) - np.floor(h * 6.0)
-    p = val * (1.0 - s)
-    q = val * (1.0 - s * f)
-    t = val * (1.0 - s * (1.0 - f))
-
-    r = np.zeros_like(val, dtype=np.float32)
-    g = np.zeros_like(val, dtype=np.float32)
-    b = np.zeros_like(val, dtype=np.float32)
-
-    m = (i == 0); r[m], g[m], b[m] = val[m], t[m], p[m]
-    m = (i == 1); r[m], g[m], b[m] = q[m], val[m], p[m]
-    m = (i == 2); r[m], g[m], b[m] = p[m], val[m], t[m]
-    m = (i == 3); r[m], g[m], b[m] = p[m], q[m], val[m]
-    m = (i == 4); r[m], g[m], b[m] = t[m], p[m], val[m]
-    m = (i == 5); r[m], g[m], b[m] = val[m], p[m], q[m]
-
-    rgb = np.stack([r, g, b], axis=-1)
-    rgb_u8 = (np.clip(rgb, 0.0, 1.0) * 255.0).astype(np.uint8)
-    a = np.full((*rgb_u8.shape[:2], 1), 255, dtype=np.uint8)
-
-    rgba = np.concatenate([rgb_u8, a], axis=-1)
-
-    # NaNs -> black
-    valid = np.isfinite(u) & np.isfinite(v)
-    rgba[~valid] = np.array([0, 0, 0, 255], dtype=np.uint8)
-
-    return rgba
-
-
 def _get_time_dim(da: xr.DataArray) -> str | None:
     if "time" in da.dims:
         return "time"
@@ -171,13 +176,24 @@ def _get_time_dim(da: xr.DataArray) -> str | None:
     return None
 
 
+def _sample_has_nan(da: xr.DataArray, time_dim: str) -> bool:
+    """
+    Whether the first time step contains NaN. Used to choose skipna for the time mean: the
+    NaN-skipping reduction is ~2x slower, and ERA5 pressure-level winds (extrapolated below
+    ground) have no missing points. The encoding's _FillValue is no hint, since CDS and
+    xarray declare one (NaN) on every float variable.
+    """
+    return bool(np.isnan(da.isel({time_dim: 0}).values).any())
+
+
 def main():
     pressureLevel = 850
     nc_path, out_png = resolve_paths()
 
     # ---- Performance knobs ----
-    # Increase time_chunk for fewer tasks + more throughput, decrease if you hit RAM pressure.
-    # On 16GB, 32–128 is usually reasonable (depends on grid size).
+    # Chunks normally follow the file's on-disk layout (see open_dataset / TARGET_CHUNK_BYTES).
+    # TIME_CHUNK only applies to contiguous files: increase for fewer tasks + more throughput,
+    # decrease if you hit RAM pressure. On 16GB, 32–128 is usually reasonable (depends on grid size).
     TIME_CHUNK = 64
 
     ds = open_dataset(nc_path, time_chunk=TIME_CHUNK)
@@ -196,26 +212,21 @@ def main():
         v_mean = v_da.values.astype(np.float32)
         n_times = 1
     else:
-        # Ensure dask chunks along the correct time dimension
-        # (If your file uses 'valid_time', we chunk that.)
-        if time_dim != "time":
-            u_da = u_da.chunk({time_dim: TIME_CHUNK})
-            v_da = v_da.chunk({time_dim: TIME_CHUNK})
-
         # Dask-backed mean; compute() triggers parallelized execution.
-        # skipna=True keeps behavior consistent with your streaming version.
-        print("Computing dask mean for U...")
-        u_mean_da = u_da.mean(dim=time_dim, skipna=True)
-        print("Computing dask mean for V...")
-        v_mean_da = v_da.mean(dim=time_dim, skipna=True)
+        # float32 end to end, and NaN skipping (as in your streaming version) only if the data has NaNs.
+        u_da = u_da.astype(np.float32)
+        v_da = v_da.astype(np.float32)
+        skipna = _sample_has_nan(u_da, time_dim) or _sample_has_nan(v_da, time_dim)
 
-        print("Computing dask mean for U...")
-        with ProgressBar():
-            u_mean = u_mean_da.compute().values.astype(np.float32, copy=False)
+        u_mean_da = u_da.mean(dim=time_dim, skipna=skipna)
+        v_mean_da = v_da.mean(dim=time_dim, skipna=skipna)
 
-        print("Computing dask mean for V...")
+        # Compute both in one pass so each time chunk of the file is read once, not once per component.
+        print("Computing dask means for U and V...")
         with ProgressBar():
-            v_mean = v_mean_da.compute().values.astype(np.float32, copy=False)
+            u_mean_da, v_mean_da = dask.compute(u_mean_da, v_mean_da)
+        u_mean = u_mean_da.values.astype(np.float32, copy=False)
+        v_mean = v_mean_da.values.astype(np.float32, copy=False)
 
         n_times = int(u_da.sizes.get(time_dim, 0))
 
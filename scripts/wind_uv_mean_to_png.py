@@ -4,6 +4,11 @@ import xarray as xr
 from PIL import Image
 from dotenv import load_dotenv
 from pathlib import Path
+from wind_viz import uv850_to_hue_value_rgba
+
+# PNG is lossless at every level; 3 encodes several times faster than Pillow's default 6 for slightly larger files.
+PNG_COMPRESS_LEVEL = 3
+
 
 def resolve_paths():
     load_dotenv()
@@ -20,128 +25,20 @@ def resolve_paths():
 
 
 
-def uv850_to_hue_value_rgba(u: np.ndarray, v: np.ndarray,
-                           vmax_mps: float = 20.0,
-                           sat: float = 0.8,
-                           gamma: float = 0.7,
-                           calm_mps: float = 0.8) -> np.ndarray:
-    """
-    850 hPa wind visualization:
-      Hue   = direction atan2(v,u)
-      Value = speed normalized by vmax_mps (clipped), with gamma compression
-      Sat   = constant sat
-      Calm  = speeds below calm_mps set to black (no hue noise)
-
-    Returns RGBA uint8 image (H,W,4).
-    """
-    u = u.astype(np.float32)
-    v = v.astype(np.float32)
-
-    spd = np.sqrt(u*u + v*v)
-    theta = np.arctan2(v, u)                 # [-pi, pi]
-    h = (theta + np.pi) / (2.0 * np.pi)      # [0, 1)
-
-    # Value from speed (fixed scale)
-    val = np.clip(spd / float(vmax_mps), 0.0, 1.0)
-    val = np.power(val, float(gamma))
-
-    # Calm masking
-    val = np.where(spd < float(calm_mps), 0.0, val)
-    s = np.where(val > 0.0, float(sat), 0.0).astype(np.float32)
-
-    # HSV -> RGB (vectorized)
-    i = np.floor(h * 6.0).astype(np.int32) % 6
-    f = (h * 6.0) - np.floor(h * 6.0)
-    p = val * (1.0 - s)
-    q = val * (1.0 - s * f)
-    t = val * (1.0 - s * (1.0 - f))
-
-    r = np.zeros_like(val, dtype=np.float32)
-    g = np.zeros_like(val, dtype=np.float32)
-    b = np.zeros_like(val, dtype=np.float32)
-
-    m = (i == 0); r[m], g[m], b[m] = val[m], t[m], p[m]
-    m = (i == 1); r[m], g[m], b[m] = q[m], val[m], p[m]
-    m = (i == 2); r[m], g[m], b[m] = p[m], val[m], t[m]
-    m = (i == 3); r[m], g[m], b[m] = p[m], q[m], val[m]
-    m = (i == 4); r[m], g[m], b[m] = t[m], p[m], val[m]
-    m = (i == 5); r[m], g[m], b[m] = val[m], p[m], q[m]
-
-    rgb = np.stack([r, g, b], axis=-1)
-    rgb_u8 = (np.clip(rgb, 0.0, 1.0) * 255.0).astype(np.uint8)
-    a = np.full((*rgb_u8.shape[:2], 1), 255, dtype=np.uint8)
-
-    rgba = np.concatenate([rgb_u8, a], axis=-1)
-
-    # NaNs -> black
-    valid = np.isfinite(u) & np.isfinite(v)
-    rgba[~valid] = np.array([0, 0, 0, 255], dtype=np.uint8)
-
-    return rgba
-
-def uv850_to_hue_sat_rgba(u: np.ndarray, v: np.ndarray,
-                         vmax_mps: float = 20.0,
-                         value_const: float = 0.9,
-                         gamma: float = 0.7,
-                         calm_mps: float = 0.8) -> np.ndarray:
-    s_min = 0.4
-    s_max = 0.6
-
-    u = u.astype(np.float32)
-    v = v.astype(np.float32)
-
-    spd = np.sqrt(u*u + v*v)
-    theta = np.arctan2(v, u)                 # [-pi, pi]
-    h = (theta + np.pi) / (2.0 * np.pi)      # [0, 1)
-
-    s = np.clip(spd / float(vmax_mps), 0.0, 1.0)
-    s = np.power(s, float(gamma))
-    s = s_min + (s_max - s_min) * s
-    s = np.where(spd < float(calm_mps), 0.0, s).astype(np.float32)
-
-    val = np.full_like(s, float(value_const), dtype=np.float32)
-
-    i = np.floor(h * 6.0).astype(np.int32) % 6
-    f = (h * 6.0) - np.floor(h * 6.0)
-    p = val * (1.0 - s)
-    q = val * (1.0 - s * f)
-    t = val * (1.0 - s * (1.0 - f))
-
-    r = np.zeros_like(val, dtype=np.float32)
-    g = np.zeros_like(val, dtype=np.float32)
-    b = np.zeros_like(val, dtype=np.float32)
-
-    m = (i == 0); r[m], g[m], b[m] = val[m], t[m], p[m]
-    m = (i == 1); r[m], g[m], b[m] = q[m], val[m], p[m]
-    m = (i == 2); r[m], g[m], b[m] = p[m], val[m], t[m]
-    m = (i == 3); r[m], g[m], b[m] = p[m], q[m], val[m]
-    m = (i == 4); r[m], g[m], b[m] = t[m], p[m], val[m]
-    m = (i == 5); r[m], g[m], b[m] = val[m], p[m], q[m]
-
-    rgb = np.stack([r, g, b], axis=-1)
-    rgb_u8 = (np.clip(rgb, 0.0, 1.0) * 255.0).astype(np.uint8)
-    a = np.full((*rgb_u8.shape[:2], 1), 255, dtype=np.uint8)
-    rgba = np.concatenate([rgb_u8, a], axis=-1)
-
-    valid = np.isfinite(u) & np.isfinite(v)
-    rgba[~valid] = np.array([0, 0, 0, 255], dtype=np.uint8)
-    return rgba
-
-
-def _maybe_flip_for_north_up(ds: xr.Dataset, rgba: np.ndarray) -> np.ndarray:
+def _north_up_rows(ds: xr.Dataset) -> slice:
     """
     PIL assumes row 0 is the top of the image.
-    If latitude is increasing (south->north), then north is at the bottom -> flipud.
-    If latitude is decreasing (north->south), already north-up -> no flip.
+    If latitude is increasing (south->north), then north is at the bottom -> reversed rows.
+    If latitude is decreasing (north->south), already north-up -> rows as-is.
     """
     for lat_name in ["latitude", "lat"]:
         if lat_name in ds.coords and ds[lat_name].ndim == 1:
             latv = ds[lat_name].values
             if latv.size >= 2 and (latv[1] - latv[0]) > 0:
-                return np.flipud(rgba)
-            return rgba
+                return slice(None, None, -1)
+            return slice(None)
     # If no lat coord, keep as-is.
-    return rgba
+    return slice(None)
 
 
 def main():
@@ -159,11 +56,16 @@ def main():
     if u.ndim != 2 or v.ndim != 2:
         raise RuntimeError(f"Expected 2D arrays, got u={u.shape}, v={v.shape}")
 
-    rgba = uv850_to_hue_value_rgba(u, v, vmax_mps=20.0, sat=0.9, gamma=0.3, calm_mps=0.7)
-    # rgba = uv850_to_hue_sat_rgba(u, v, vmax_mps=20.0, value_const=0.7, gamma=0.3, calm_mps=0.8)
-    rgba = _maybe_flip_for_north_up(ds, rgba)
+    # Flip for north-up display on the inputs: reversed views cost nothing, and the
+    # renderer then produces a contiguous, already north-up RGBA (no flipud copy for PIL)
+    rows = _north_up_rows(ds)
+    u_img, v_img = u[rows], v[rows]
+
+    rgba = uv850_to_hue_value_rgba(u_img, v_img, vmax_mps=20.0, sat=0.9, gamma=0.3, calm_mps=0.7)
+    # from wind_viz import uv850_to_hue_sat_rgba
+    # rgba = uv850_to_hue_sat_rgba(u_img, v_img, vmax_mps=20.0, value_const=0.7, gamma=0.3, calm_mps=0.8)
 
-    Image.fromarray(rgba, mode="RGBA").save(out_png)
+    Image.fromarray(rgba, mode="RGBA").save(out_png, compress_level=PNG_COMPRESS_LEVEL)
 
     print(f"Wrote PNG: {out_png}")
     print(f"U mean range: [{float(np.nanmin(u)):.3f}, {float(np.nanmax(u)):.3f}] m/s")
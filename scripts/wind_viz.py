@@ -0,0 +1,153 @@
+# wind_viz.py
+#
+# Wind direction/speed -> HSV -> RGBA rendering shared by the wind scripts
+# (wind_uv_mean_to_png.py imports it; scripts are run from this folder so it resolves as a sibling module).
+#   Hue = direction atan2(v,u), Value or Saturation = speed.
+
+import numpy as np
+
+# Rows per band in the HSV conversions. Each band's ~15 float temporaries stay cache-sized
+# instead of being full-image arrays streamed through memory once per numpy op.
+ROW_BLOCK = 64
+
+
+def _apply_gamma(x: np.ndarray, gamma: float) -> None:
+    """x **= gamma in place, using sqrt / no-op for the exponents that have one."""
+    if gamma == 1.0:
+        return
+    if gamma == 0.5:
+        np.sqrt(x, out=x)  # ~4x cheaper than pow()
+    else:
+        # numpy's float32 pow is SIMD-vectorized; a lookup table or exp2(log2(x)*g) measured slower
+        np.power(x, gamma, out=x)
+
+
+def _hue_value_band(u: np.ndarray, v: np.ndarray, out: np.ndarray,
+                    vmax_mps: float, sat: float, gamma: float, calm_mps: float) -> None:
+    # Speed and hue each live in one buffer that is updated in place
+    spd = u * u
+    spd += v * v
+    np.sqrt(spd, out=spd)                    # same rounding as sqrt(u*u + v*v), unlike np.hypot
+    h = np.arctan2(v, u)                     # [-pi, pi]
+    h += np.pi
+    h /= 2.0 * np.pi                         # [0, 1)
+
+    # Value from speed (fixed scale)
+    val = np.divide(spd, float(vmax_mps))
+    np.clip(val, 0.0, 1.0, out=val)
+    _apply_gamma(val, float(gamma))
+
+    # Calm masking
+    val[spd < float(calm_mps)] = 0.0
+    s = np.where(val > 0.0, float(sat), 0.0).astype(np.float32)
+
+    # HSV -> RGB (vectorized); h*6 and its floor are computed once
+    h *= 6.0
+    sector = np.floor(h)
+    i = sector.astype(np.int32) % 6
+    f = np.subtract(h, sector, out=h)
+    p = val * (1.0 - s)
+    q = val * (1.0 - s * f)
+    t = val * (1.0 - s * (1.0 - f))
+
+    # Sector i (0..5) picks which of val/p/q/t feeds each channel; one gather per channel
+    r = np.choose(i, (val, q, p, p, t, val))
+    g = np.choose(i, (t, val, val, q, p, p))
+    b = np.choose(i, (p, p, t, val, val, q))
+
+    # Scale each channel straight into its uint8 slot of the output (no stacked float copy)
+    for c, chan in enumerate((r, g, b)):
+        np.clip(chan, 0.0, 1.0, out=chan)
+        np.multiply(chan, 255.0, out=out[..., c], casting="unsafe")
+    out[..., 3] = 255
+
+    # NaNs -> black
+    valid = np.isfinite(u) & np.isfinite(v)
+    out[~valid] = np.array([0, 0, 0, 255], dtype=np.uint8)
+
+
+def uv850_to_hue_value_rgba(u: np.ndarray, v: np.ndarray,
+                           vmax_mps: float = 20.0,
+                           sat: float = 0.8,
+                           gamma: float = 0.7,
+                           calm_mps: float = 0.8) -> np.ndarray:
+    """
+    850 hPa wind visualization:
+      Hue   = direction atan2(v,u)
+      Value = speed normalized by vmax_mps (clipped), with gamma compression
+      Sat   = constant sat
+      Calm  = speeds below calm_mps set to black (no hue noise)
+
+    Returns RGBA uint8 image (H,W,4).
+    """
+    # No copy when already float32; strided views (e.g. north-up u[::-1]) are read in place per band
+    u = np.asarray(u, dtype=np.float32)
+    v = np.asarray(v, dtype=np.float32)
+
+    rgba = np.empty((*u.shape, 4), dtype=np.uint8)
+    for y0 in range(0, u.shape[0], ROW_BLOCK):
+        rows = slice(y0, y0 + ROW_BLOCK)
+        _hue_value_band(u[rows], v[rows], rgba[rows], vmax_mps, sat, gamma, calm_mps)
+    return rgba
+
+
+def _hue_sat_band(u: np.ndarray, v: np.ndarray, out: np.ndarray,
+                  vmax_mps: float, value_const: float, gamma: float, calm_mps: float) -> None:
+    s_min = 0.4
+    s_max = 0.6
+
+    # Speed and hue each live in one buffer that is updated in place
+    spd = u * u
+    spd += v * v
+    np.sqrt(spd, out=spd)                    # same rounding as sqrt(u*u + v*v), unlike np.hypot
+    h = np.arctan2(v, u)                     # [-pi, pi]
+    h += np.pi
+    h /= 2.0 * np.pi                         # [0, 1)
+
+    s = np.divide(spd, float(vmax_mps))
+    np.clip(s, 0.0, 1.0, out=s)
+    _apply_gamma(s, float(gamma))
+    s *= s_max - s_min
+    s += s_min
+    s[spd < float(calm_mps)] = 0.0
+
+    val = np.full_like(s, float(value_const), dtype=np.float32)
+
+    # h*6 and its floor are computed once
+    h *= 6.0
+    sector = np.floor(h)
+    i = sector.astype(np.int32) % 6
+    f = np.subtract(h, sector, out=h)
+    p = val * (1.0 - s)
+    q = val * (1.0 - s * f)
+    t = val * (1.0 - s * (1.0 - f))
+
+    # Sector i (0..5) picks which of val/p/q/t feeds each channel; one gather per channel
+    r = np.choose(i, (val, q, p, p, t, val))
+    g = np.choose(i, (t, val, val, q, p, p))
+    b = np.choose(i, (p, p, t, val, val, q))
+
+    # Scale each channel straight into its uint8 slot of the output (no stacked float copy)
+    for c, chan in enumerate((r, g, b)):
+        np.clip(chan, 0.0, 1.0, out=chan)
+        np.multiply(chan, 255.0, out=out[..., c], casting="unsafe")
+    out[..., 3] = 255
+
+    valid = np.isfinite(u) & np.isfinite(v)
+    out[~valid] = np.array([0, 0, 0, 255], dtype=np.uint8)
+
+
+def uv850_to_hue_sat_rgba(u: np.ndarray, v: np.ndarray,
+                         vmax_mps: float = 20.0,
+                         value_const: float = 0.9,
+                         gamma: float = 0.7,
+                         calm_mps: float = 0.8) -> np.ndarray:
+    # No copy when already float32; strided views (e.g. north-up u[::-1]) are read in place per band
+    u = np.asarray(u, dtype=np.float32)
+    v = np.asarray(v, dtype=np.float32)
+
+    rgba = np.empty((*u.shape, 4), dtype=np.uint8)
+    for y0 in range(0, u.shape[0], ROW_BLOCK):
+        rows = slice(y0, y0 + ROW_BLOCK)
+        _hue_sat_band(u[rows], v[rows], rgba[rows], vmax_mps, value_const, gamma, calm_mps)
+    return rgba
@@ -15,16 +15,21 @@ Assumptions / knobs
 - Precip is typically mm. We display it as grayscale with a robust normalization.
 - NoData values are read from the raster and converted to NaN.
 
-pip install rasterio numpy matplotlib
+pip install rasterio numpy matplotlib pillow
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 import rasterio
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib import font_manager
+from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 from pathlib import Path
+from color_scale import partition_percentile
 
 load_dotenv()
 
@@ -36,9 +41,9 @@ OUT_DIR.mkdir(parents=True, exist_ok=True)
 # If the BIO temperature variables look 10x too large, use 0.1
 TEMP_SCALE = 0.1  # <-- change to 1.0 if already in °C
 
-# Plot sizing
-FIGSIZE = (12, 6)
-DPI = 200
+# Image output: one pixel per raster cell, title in a white strip above the map
+PNG_COMPRESS_LEVEL = 3       # lossless; much faster to encode than Pillow's default 6
+NAN_RGB = (255, 255, 255)    # NoData color: white, same as the title strip
 
 # Robust display percentiles
 TEMP_ABS_PCT = 99  # vmax = percentile(abs(temp), 99), symmetric about 0°C
@@ -79,13 +84,88 @@ INDEX_KINDS = {"temp_index", "precip_index"}
 def read_tif_as_float(path: Path) -> np.ndarray:
     """Read band 1 as float32; map NoData to NaN."""
     with rasterio.open(path) as src:
-        a = src.read(1).astype(np.float32)
+        raw = src.read(1)
         nodata = src.nodata
-        if nodata is not None:
-            a[a == nodata] = np.nan
+    # Compare against NoData on the native (usually int16) band, half the bytes of the float copy
+    a = raw.astype(np.float32)
+    if nodata is not None:
+        np.putmask(a, raw == nodata, np.nan)
     return a
 
 
+# Colormap tables hold 256 colors plus NAN_RGB at this index
+NAN_INDEX = 256
+
+
+@lru_cache(maxsize=None)
+def _cmap_lut(cmap_name: str) -> np.ndarray:
+    """(257, 3) uint8 table: the 256 colors of a matplotlib colormap, then NAN_RGB."""
+    lut = np.empty((NAN_INDEX + 1, 3), dtype=np.uint8)
+    lut[:NAN_INDEX] = matplotlib.colormaps[cmap_name](np.arange(NAN_INDEX), bytes=True)[:, :3]
+    lut[NAN_INDEX] = NAN_RGB
+    return lut
+
+
+def colormap_rgb(arr: np.ndarray, vmin: float, vmax: float, cmap_name: str) -> np.ndarray:
+    """
+    Map arr linearly from [vmin, vmax] (clipped) through a colormap to (H, W, 3) uint8; NaN -> NAN_RGB.
+    Same binning as matplotlib's imshow (256 bins), but a single table lookup instead of a figure.
+    """
+    idx = (arr.astype(np.float32) - vmin) * np.float32(NAN_INDEX / (vmax - vmin))
+    np.clip(idx, 0, NAN_INDEX - 1, out=idx)
+    idx[np.isnan(arr)] = NAN_INDEX
+    return _cmap_lut(cmap_name)[idx.astype(np.uint16)]
+
+
+@lru_cache(maxsize=None)
+def _title_font(size: int) -> ImageFont.FreeTypeFont:
+    # DejaVu Sans ships with matplotlib and covers the "—", "°", "×", "−" used in the titles
+    return ImageFont.truetype(font_manager.findfont("DejaVu Sans"), size)
+
+
+# Smallest title font size before the title wraps onto more lines instead of shrinking further
+TITLE_MIN_SIZE = 6
+
+
+def _wrap_title(title: str, font: ImageFont.FreeTypeFont, max_w: float) -> list[str]:
+    """Greedy word wrap of title to max_w; a single word still too wide is ellipsized."""
+    lines = []
+    for word in title.split():
+        if lines and font.getlength(f"{lines[-1]} {word}") <= max_w:
+            lines[-1] = f"{lines[-1]} {word}"
+        else:
+            lines.append(word)
+    for i, line in enumerate(lines):
+        while len(line) > 1 and font.getlength(line + "…") > max_w and font.getlength(line) > max_w:
+            line = line[:-1]
+        lines[i] = line if font.getlength(line) <= max_w else line + "…"
+    return lines
+
+
+def save_png_with_title(rgb: np.ndarray, out_png: Path, title: str):
+    """Write rgb as a PNG with `title` centered in a white strip above it."""
+    h, w = rgb.shape[:2]
+    max_w = 0.96 * w
+
+    # Font scales with the map width; shrink it until the title fits, and on rasters too
+    # narrow for that even at TITLE_MIN_SIZE, wrap the title instead of letting Pillow crop it
+    size = max(10, w // 60)
+    font = _title_font(size)
+    while size > TITLE_MIN_SIZE and font.getlength(title) > max_w:
+        size -= 1
+        font = _title_font(size)
+    lines = [title] if font.getlength(title) <= max_w else _wrap_title(title, font, max_w)
+    line_h = int(1.25 * size)
+    strip_h = 2 * size + (len(lines) - 1) * line_h
+
+    canvas = Image.new("RGB", (w, h + strip_h), "white")
+    canvas.paste(Image.fromarray(rgb, mode="RGB"), (0, strip_h))
+    draw = ImageDraw.Draw(canvas)
+    for i, line in enumerate(lines):
+        draw.text((w / 2, size + i * line_h), line, fill="black", font=font, anchor="mm")
+    canvas.save(out_png, compress_level=PNG_COMPRESS_LEVEL)
+
+
 def save_temp_diverging(temp_c: np.ndarray, out_png: Path, title: str):
     """
     Blue-red diverging map for temperature-like fields.
@@ -95,16 +175,11 @@ def save_temp_diverging(temp_c: np.ndarray, out_png: Path, title: str):
     if valid.size == 0:
         raise ValueError(f"No valid temperature values to plot for {out_png.name}")
 
-    vmax = float(np.nanpercentile(np.abs(valid), TEMP_ABS_PCT))
+    vmax = partition_percentile(np.abs(valid), TEMP_ABS_PCT)
     vmax = max(vmax, 1.0)
 
-    plt.figure(figsize=FIGSIZE, dpi=DPI)
-    plt.imshow(temp_c, cmap="coolwarm", vmin=-vmax, vmax=vmax, interpolation="nearest")
-    plt.title(title, fontsize=12)
-    plt.axis("off")
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
-    plt.savefig(out_png, bbox_inches="tight", pad_inches=0.05)
-    plt.close()
+    rgb = colormap_rgb(temp_c, -vmax, vmax, "coolwarm")
+    save_png_with_title(rgb, out_png, title)
 
 
 def save_grayscale_robust(arr: np.ndarray, out_png: Path, title: str):
@@ -116,56 +191,63 @@ def save_grayscale_robust(arr: np.ndarray, out_png: Path, title: str):
     if valid.size == 0:
         raise ValueError(f"No valid values to plot for {out_png.name}")
 
-    vmax = float(np.nanpercentile(valid, PRECIP_PCT))
+    vmax = partition_percentile(valid, PRECIP_PCT)
     if vmax <= 0:
         # If everything is <=0 (rare for precip, possible for some indices),
         # fall back to absolute-based scaling.
-        vmax = float(np.nanpercentile(np.abs(valid), PRECIP_PCT))
+        vmax = partition_percentile(np.abs(valid), PRECIP_PCT)
         vmax = max(vmax, 1e-6)
 
-    arr01 = np.clip(arr / vmax, 0.0, 1.0)
+    rgb = colormap_rgb(arr, 0.0, vmax, "gray")
+    save_png_with_title(rgb, out_png, title)
+
+
+def _render(i: int) -> str:
+    """Read BIO{i}, render its PNG and return the summary line. Top-level so worker processes can run it."""
+    tif = BIO_DIR / f"cclgmbi{i}.tif"
+
+    meta = BIO_META[i]
+    name = meta["name"]
+    units = meta["units"]
+    kind = meta["kind"]
+
+    arr = read_tif_as_float(tif)
+
+    # Apply TEMP_SCALE only for true temperature-unit variables (°C)
+    if kind in TEMP_LIKE_KINDS:
+        arr = arr * TEMP_SCALE
+
+    title = f"LGM CCSM4 — BIO{i}: {name} ({units})"
+    out_png = OUT_DIR / f"lgm_bio{i:02d}.png"
 
-    plt.figure(figsize=FIGSIZE, dpi=DPI)
-    plt.imshow(arr01, cmap="gray", vmin=0.0, vmax=1.0, interpolation="nearest")
-    plt.title(title, fontsize=12)
-    plt.axis("off")
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
-    plt.savefig(out_png, bbox_inches="tight", pad_inches=0.05)
-    plt.close()
+    # Choose rendering style
+    if kind in TEMP_LIKE_KINDS:
+        save_temp_diverging(arr, out_png, title=title)
+    else:
+        # precip + index -> grayscale
+        save_grayscale_robust(arr, out_png, title=title)
+
+    vmin = float(np.nanmin(arr)) if np.isfinite(arr).any() else float("nan")
+    vmax = float(np.nanmax(arr)) if np.isfinite(arr).any() else float("nan")
+    return f"Saved {out_png.name}  |  data min/max: {vmin:.3f} .. {vmax:.3f}"
 
 
 def main():
     missing = []
+    todo = []
     for i in range(1, 20):
         tif = BIO_DIR / f"cclgmbi{i}.tif"
         if not tif.exists():
             missing.append(str(tif))
-            continue
-
-        meta = BIO_META[i]
-        name = meta["name"]
-        units = meta["units"]
-        kind = meta["kind"]
-
-        arr = read_tif_as_float(tif)
-
-        # Apply TEMP_SCALE only for true temperature-unit variables (°C)
-        if kind in TEMP_LIKE_KINDS:
-            arr = arr * TEMP_SCALE
-
-        title = f"LGM CCSM4 — BIO{i}: {name} ({units})"
-        out_png = OUT_DIR / f"lgm_bio{i:02d}.png"
-
-        # Choose rendering style
-        if kind in TEMP_LIKE_KINDS:
-            save_temp_diverging(arr, out_png, title=title)
         else:
-            # precip + index -> grayscale
-            save_grayscale_robust(arr, out_png, title=title)
-
-        vmin = float(np.nanmin(arr)) if np.isfinite(arr).any() else float("nan")
-        vmax = float(np.nanmax(arr)) if np.isfinite(arr).any() else float("nan")
-        print(f"Saved {out_png.name}  |  data min/max: {vmin:.3f} .. {vmax:.3f}")
+            todo.append(i)
+
+    # The 19 renders are independent and CPU-bound (raster read, colormap table lookup and
+    # Pillow PNG encode), so run them in separate processes; results come back in BIO order.
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(len(todo), os.cpu_count() or 1)) as ex:
+            for line in ex.map(_render, todo):
+                print(line)
 
     if missing:
         print("\nMissing files:")
@@ -11,10 +11,12 @@
 # pip install rasterio matplotlib numpy
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
+from color_scale import partition_percentile
 
 load_dotenv()
 # ---------------- CONFIG ----------------
@@ -47,24 +49,57 @@ out_tx_png = "./worldClimImages/lgm_tx_annual_mean_and_warmest_day.png"
 
 def read_stack(folder: str, pattern: str, months_range) -> tuple[np.ndarray, float]:
     """Read 12 monthly rasters into a (12, H, W) float32 stack, masking NoData to NaN."""
-    stack = []
-    nodata = None
-
-    for m in months_range:
-        path = os.path.join(folder, pattern.format(m=m))
+    paths = [os.path.join(folder, pattern.format(m=m)) for m in months_range]
+    for path in paths:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Missing file: {path}")
 
-        with rasterio.open(path) as src:
-            if nodata is None:
-                nodata = src.nodata
+    # Shape and NoData come from the first month (its NoData is applied to every month)
+    with rasterio.open(paths[0]) as src:
+        nodata = src.nodata
+        stack = np.empty((len(paths), src.height, src.width), dtype=np.float32)
+
+    def _read_month(i: int) -> None:
+        with rasterio.open(paths[i]) as src:
+            a = src.read(1, out=stack[i])  # GDAL converts to float32 straight into the stack slice
+        if nodata is not None:
+            a[a == nodata] = np.nan
+
+    # GDAL releases the GIL while reading/decoding, so the months load in parallel on threads
+    with ThreadPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as ex:
+        list(ex.map(_read_month, range(len(paths))))
+
+    return stack, nodata
+
+
+def month_stats(stack: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    NaN-aware per-pixel (sum, count, min, max) across the months of a (12, H, W) stack.
+    One streaming pass folds each month into 2D accumulators, instead of separate
+    nansum/nanmean/nanmax/nanmin passes that each rebuild a full (12, H, W) NaN mask.
+    Pixels that are NaN in every month get sum 0, count 0 and NaN min/max.
+    """
+    shape = stack.shape[1:]
+    total = np.zeros(shape, dtype=np.float32)
+    count = np.zeros(shape, dtype=np.int32)
+    lo = np.full(shape, np.nan, dtype=np.float32)
+    hi = np.full(shape, np.nan, dtype=np.float32)
 
-            a = src.read(1).astype(np.float32)
-            if nodata is not None:
-                a[a == nodata] = np.nan
-            stack.append(a)
+    for month in stack:
+        finite = ~np.isnan(month)
+        np.add(total, month, out=total, where=finite)
+        count += finite
+        # fmin/fmax ignore NaN operands, so NaN months are skipped and all-NaN pixels stay NaN
+        np.fmin(lo, month, out=lo)
+        np.fmax(hi, month, out=hi)
 
-    return np.stack(stack, axis=0), nodata
+    return total, count, lo, hi
+
+
+def nan_mean_from_stats(total: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """total / count in float32; NaN where count is 0 (like np.nanmean on an all-NaN slice)."""
+    with np.errstate(invalid="ignore"):
+        return np.divide(total, count, dtype=np.float32)
 
 
 def save_grayscale01(arr01: np.ndarray, out_png: str, title: str | None = None):
@@ -88,7 +123,7 @@ def save_temp_diverging(temp_c: np.ndarray, out_png: str, title: str):
     if valid.size == 0:
         raise ValueError("No valid temperature values to plot.")
 
-    vmax = float(np.nanpercentile(np.abs(valid), 99))
+    vmax = partition_percentile(np.abs(valid), 99)
     vmax = max(vmax, 1.0)
 
     plt.figure(figsize=(12, 6), dpi=200)
@@ -108,7 +143,7 @@ def save_temp_diverging(temp_c: np.ndarray, out_png: str, title: str):
 
 # ----------------- PRECIP (annual sum) -----------------
 pr_stack, _ = read_stack(pr_dir, pr_pattern, months)
-pr_annual = np.nansum(pr_stack, axis=0)  # mm/year (since mm/month summed)
+pr_annual, _, _, _ = month_stats(pr_stack)  # mm/year (since mm/month summed)
 
 # For display: treat NaN as 0 precip
 pr_display = np.nan_to_num(pr_annual, nan=0.0)
@@ -125,8 +160,11 @@ print(f"Precip annual-sum max (raw units): {pr_max}")
 tn_stack, _ = read_stack(tn_dir, tn_pattern, months)
 tn_stack *= TEMP_SCALE
 
-tn_mean = np.nanmean(tn_stack, axis=0)         # average of the 12 monthly tn fields
-tn_max_of_mins = np.nanmax(tn_stack, axis=0)   # highest "minimum temp" across months (warmest tn)
+# One pass gives everything below: annual mean, and the coldest/warmest month per pixel
+tn_sum, tn_count, tn_min, tn_max = month_stats(tn_stack)
+
+tn_mean = nan_mean_from_stats(tn_sum, tn_count)  # average of the 12 monthly tn fields
+tn_max_of_mins = tn_max                          # highest "minimum temp" across months (warmest tn)
 
 print("TN mean (C) min/max:", float(np.nanmin(tn_mean)), float(np.nanmax(tn_mean)))
 print("TN max-of-mins (C) min/max:", float(np.nanmin(tn_max_of_mins)), float(np.nanmax(tn_max_of_mins)))
@@ -139,8 +177,10 @@ print(f"Saved: {out_tn_png}")
 tx_stack, _ = read_stack(tx_dir, tx_pattern, months)
 tx_stack *= TEMP_SCALE
 
-tx_mean = np.nanmean(tx_stack, axis=0)         # average of the 12 monthly tx fields
-tx_max_of_maxes = np.nanmax(tx_stack, axis=0)  # highest "maximum temp" across months (warmest tx)
+tx_sum, tx_count, tx_min, tx_max = month_stats(tx_stack)
+
+tx_mean = nan_mean_from_stats(tx_sum, tx_count)  # average of the 12 monthly tx fields
+tx_max_of_maxes = tx_max                         # highest "maximum temp" across months (warmest tx)
 
 print("TX mean (C) min/max:", float(np.nanmin(tx_mean)), float(np.nanmax(tx_mean)))
 print("TX max-of-maxes (C) min/max:", float(np.nanmin(tx_max_of_maxes)), float(np.nanmax(tx_max_of_maxes)))
@@ -149,27 +189,15 @@ save_temp_diverging(tx_mean, out_tx_png, title="LGM CCSM4: TX mean (°C)")
 print(f"Saved: {out_tx_png}")
 
 # ---- Seasonal extreme maps (per-pixel, across the 12 months) ----
-# tn_stack, tx_stack are shape (12, H, W) in °C (after TEMP_SCALE)
-
-# mask for pixels that are NaN in all months (prevents warnings + gives clean NaNs)
-tn_allnan = np.all(np.isnan(tn_stack), axis=0)
-tx_allnan = np.all(np.isnan(tx_stack), axis=0)
+# From the month_stats passes above; pixels that are NaN in all months are already NaN here.
 
 # Coldest/warmest month for TN (cold-side temps)
-with np.errstate(invalid="ignore"):
-    tn_coldest_month = np.nanmin(tn_stack, axis=0)   # winter-peak severity proxy
-    tn_warmest_month = np.nanmax(tn_stack, axis=0)   # warmest nights proxy
-
-tn_coldest_month[tn_allnan] = np.nan
-tn_warmest_month[tn_allnan] = np.nan
+tn_coldest_month = tn_min   # winter-peak severity proxy
+tn_warmest_month = tn_max   # warmest nights proxy
 
 # Coldest/warmest month for TX (warm-side temps)
-with np.errstate(invalid="ignore"):
-    tx_coldest_month = np.nanmin(tx_stack, axis=0)   # coldest days proxy
-    tx_warmest_month = np.nanmax(tx_stack, axis=0)   # summer-peak heat proxy
-
-tx_coldest_month[tx_allnan] = np.nan
-tx_warmest_month[tx_allnan] = np.nan
+tx_coldest_month = tx_min   # coldest days proxy
+tx_warmest_month = tx_max   # summer-peak heat proxy
 
 # Output PNGs (blue=cold, red=warm)
 # Night-time (TN) extremes